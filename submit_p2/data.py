@@ -3,7 +3,6 @@
 import xml.etree.ElementTree as ET
 import pprint
 import re
-import codecs
 import json
 """
 Your task is to wrangle the data and transform the shape of the data
@@ -153,15 +152,15 @@ def process_map(file_in, pretty = False):
     # You do not need to change this file
     file_out = "{0}.json".format(file_in)
     data = []
-    with codecs.open(file_out, "w") as fo:
+    with open(file_out, "wb") as fo:
         for _, element in ET.iterparse(file_in):
             el = shape_element(element)
             if el:
                 data.append(el)
                 if pretty:
-                    fo.write(json.dumps(el, indent=2)+"\n")
+                    fo.write(json.dumps(el, indent=2).encode("utf-8") + b"\n")
                 else:
-                    fo.write(json.dumps(el) + "\n")
+                    fo.write(json.dumps(el).encode("utf-8") + b"\n")
     return data
 
 def test():
@@ -0,0 +1,38 @@
+# Cython declarations for data_additional.py (pure-Python mode).
+# Only used when the module is compiled with "cythonize -i data_additional.py";
+# the plain Python script ignores this file.
+# The compiled module targets Python 3, where lxml returns attribute values as str.
+cimport cython
+
+# bound regex methods, looked up as C globals instead of module attributes
+cdef object _lower_colon_search
+cdef object _addr_match
+cdef object _addr_clean_sub
+cdef object _re_phonenumber_search
+cdef object _re_city_ward_match
+
+cdef dict _FW_TABLE
+
+cdef str _nfkc(str s)
+cdef str _halfwidth(str s)
+
+@cython.locals(m=object)
+cpdef _clean_city(str text, dict address, dict node)
+
+cdef object _norm_postcode(str t)
+
+@cython.locals(postnum=object)
+cpdef _clean_postcode(str text, dict address, dict node)
+
+@cython.locals(phonenum=object, postnum=object)
+cdef _clean_confused(str key, str text, dict address, dict node)
+
+cpdef _clean_street(str text, dict address, dict node)
+cpdef _clean_housenumber(str text, dict address, dict node)
+cpdef _clean_generic(str text, dict address, dict node)
+
+@cython.locals(node=dict, created=dict, address=dict, node_refs=list,
+               atr_id=str, version=str, changeset=str, timestamp=str, user=str, uid=str,
+               lat=str, lon=str, known=cython.Py_ssize_t,
+               atr=str, value=str, tk=str, tagv=str, ad_cont=str, key=str, text=str)
+cpdef dict _shape(str kind, object attrib, object tags, object nds)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+# cython: language_level=3str
 """
 OpenStreetMap Sample Project Data Wrangling with MongoDB
 This program transforms the shape of the OSM data into a list of dictionaries, and save the data as a JSON file.
@@ -26,208 +27,517 @@ are turned into
   - remove hyphen in "postcode". 123-4567 is turned into 1234567.
   - if "street" or "housenumber" contains phonenubmer or postcode, those values are moved to the right places.
 
-
+shape_element is called once per element, so for large files this module can be compiled
+with Cython as it is (no .pyx is needed): "cythonize -i data_additional.py".
+The C types of the hot functions are declared in data_additional.pxd.
+The compiled module (Python 3 only) is imported in place of this file.
 """
 
 
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
 import pprint
 import re
-import codecs
 import json
+import multiprocessing
+import os
+import shutil
 import string
 import unicodedata
+try:
+    import orjson # serializes straight into UTF-8 bytes
+except ImportError:
+    orjson = None
 
-lower = re.compile(r'^([a-z]|_)*$')
-lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
-problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n\s　]')
+# re.ASCII only exists (and only matters) on Python 3
+lower = re.compile(r'^([a-z]|_)*$', getattr(re, "ASCII", 0))
+lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$', getattr(re, "ASCII", 0))
+# problematic characters for "k" values: punctuation and whitespace (including full-width space)
+PROBLEMCHARS = frozenset(u"=+/&<>;'\"?%#$@,. \t\n\v\f\r\x1c\x1d\x1e\x1f\x85\xa0\u1680"
+                         u"\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a"
+                         u"\u2028\u2029\u202f\u205f\u3000")
 addr = re.compile(r'addr:')
-addr_problemchars = re.compile(r'\((.)*\)|yes') # problematic characters for address values (parenthesized characters and "yes")
-addr_semicolon = re.compile(r';(.)*$') # separated characters by ";"
-addr_space = re.compile(r'[\s　]') # whitespace
-re_postcode = re.compile(r'^([0-9]{3}-[0-9]{4}$)') # postcode with hyphen
+# problematic characters for address values: parenthesized characters, "yes", characters separated by ";", and whitespace
+addr_clean = re.compile(u"\\([^)]*\\)|yes|;.*$|[\\s　]", re.UNICODE)
 re_phonenumber = re.compile(r'(^(0[0-9]{2}-[0-9]{3}-[0-9]{4}$)|^(81\s[0-9]+$))') # phonenumber
-re_city = re.compile(u"[^府]+市") # city
-re_ward = re.compile(u"[^市]+区(.)*") # ward　
+# prefecture(***府), city(***市) and ward(***区).
+# the prefecture and the city cannot contain a city or a ward, so they never run into the ward
+re_city_ward = re.compile(u"(?:[^府市区]+府)?(?P<city>[^府区]+市)?(?P<ward>[^市]+区.*)?")
+
+# bound methods of the patterns above, used in the shape_element loop
+_lower_colon_search = lower_colon.search
+_addr_match = addr.match
+_addr_clean_sub = addr_clean.sub
+_re_phonenumber_search = re_phonenumber.search
+_re_city_ward_match = re_city_ward.match
 
 #chars = re.compile(u"[一-龥ぁ-んァ-ン0-9０-９a-zA-Z]*")
 #wrong_housenumber = re.compile(r'([0-9]{3}-[0-9]{3}-[0-9]{4}|[0-9]{3}-[0-9]{4}|81\s[0-9]+$)')
 
 CREATED = [ "version", "changeset", "timestamp", "user", "uid"]
 
+
+# attributes which are not turned into regular key/value pairs
+KNOWN_ATTRIBUTES = set(["id", "lat", "lon"] + CREATED)
+
+try:
+    _isascii = str.isascii
+except AttributeError: # Python 2
+    def _isascii(s):
+        try:
+            s.encode("ascii")
+        except UnicodeError:
+            return False
+        return True
+
+# converts full-width numbers and encircled numbers into half-width ones.
+# pure ASCII strings are already NFKC-normalized, so they are returned as they are.
+def _nfkc(s):
+    return s if _isascii(s) else unicodedata.normalize('NFKC', s)
+
+# full-width digits (０-９) and encircled numbers (①-⑨) to half-width digits
+_FW_TABLE = dict([(0xFF10 + i, u"%d" % i) for i in range(10)] +
+                 [(0x2460 + i, u"%d" % (i + 1)) for i in range(9)])
+
+# cheaper than _nfkc for values that only need half-width digits
+def _halfwidth(s):
+    return s if _isascii(s) else s.translate(_FW_TABLE)
+
+## address cleaners, called with the cleaned value, the "address" dictionary and the node
+def _clean_city(text, address, node):
+    ## "city" value only contains "city(***市)" 
+    ## city and ward are extracted in one scan
+    m = _re_city_ward_match(text)
+    address["city"] = m.group("city") or ""
+
+    ## if "city" value contains "ward(***区)", that part is moved to "street" value 
+    text = m.group("ward")
+    if text:
+        if "street" in address:
+            address["street"] = text + address["street"]
+        else:
+            address["street"] = text
+
+def test_clean_city():
+    # (city value, expected city, expected street)
+    cases = [(u"京都市", u"京都市", None),
+             (u"京都市中京区", u"京都市", u"中京区"),
+             (u"京都府京都市左京区", u"京都市", u"左京区"),
+             (u"京都市左京区市原", u"京都市", u"左京区市原"),
+             (u"京都市上京区京都府庁前", u"京都市", u"上京区京都府庁前"),
+             (u"京都市中京区府庁", u"京都市", u"中京区府庁"),
+             (u"京都府中京区", u"", u"中京区"),
+             (u"中京区市役所", u"", u"中京区市役所"),
+             (u"四日市市", u"四日市市", None),
+             (u"四日市市北区", u"四日市市", u"北区"),
+             (u"廿日市市", u"廿日市市", None)]
+    for text, city, street in cases:
+        address = {}
+        _clean_city(text, address, {})
+        assert address["city"] == city, text
+        assert address.get("street") == street, text
+
+## returns a postcode with hyphen (123-4567) without the hyphen, otherwise None.
+## only ASCII digits are accepted, like [0-9]
+def _norm_postcode(t):
+    return t.replace("-", "") if (len(t) == 8 and t[3] == "-" and _isascii(t)
+                                  and t[:3].isdigit() and t[4:].isdigit()) else None
+
+def _clean_postcode(text, address, node):
+    ## remove hyphen from "postcode"
+    postnum = _norm_postcode(text)
+    if postnum:
+        address["postcode"] = postnum
+
+def _clean_confused(key, text, address, node):
+    ## solve confused "housenumber"/"street" problem 
+    phonenum = _re_phonenumber_search(text)
+    postnum = _norm_postcode(text)
+    ## phonenumber goes to "phone" value in "created" dictionary
+    if phonenum:
+        if "phone" not in node["created"]:
+            node["created"]["phone"] = text
+            address[key] = ""
+    ## postcode goes to "postcode" value in "address" dictionary
+    elif postnum:
+        if "postcode" not in address:
+            address["postcode"] = postnum
+            address[key] = ""
+
+def _clean_street(text, address, node):
+    _clean_confused("street", text, address, node)
+
+def _clean_housenumber(text, address, node):
+    _clean_confused("housenumber", text, address, node)
+
+def _clean_generic(text, address, node):
+    pass
+
+_CLEANERS = {"city": _clean_city,
+             "street": _clean_street,
+             "housenumber": _clean_housenumber,
+             "housename": _clean_generic,
+             "postcode": _clean_postcode}
+
+# shapes a "node" or a "way" (kind) from its attributes, its "tag" children and its "nd" children.
+# the children only need a get() method, so both lxml elements and attribute dictionaries can be passed.
+def _shape(kind, attrib, tags, nds):
+    get = attrib.get
+
+    # OSM attributes are known, so they are looked up directly,
+    # and the dictionaries are built as literals when all of them are present
+    # converts full-width numbers and encircled numbers into half-width ones
+    atr_id = get("id")
+    if atr_id is not None:
+        node = {"type": kind, "id": _nfkc(atr_id)}
+    else:
+        node = {"type": kind}
+
+    # attributes in the CREATED array are added under a key "created"
+    version = get("version")
+    changeset = get("changeset")
+    timestamp = get("timestamp")
+    user = get("user")
+    uid = get("uid")
+    if (version is not None and changeset is not None and timestamp is not None
+            and user is not None and uid is not None):
+        created = {"version": _halfwidth(version),
+                   "changeset": _halfwidth(changeset),
+                   "timestamp": _nfkc(timestamp),
+                   "user": _nfkc(user),
+                   "uid": _halfwidth(uid)}
+    else:
+        # e.g. anonymous edits have no "user" and "uid"
+        created = {}
+        if version is not None:
+            created["version"] = _halfwidth(version)
+        if changeset is not None:
+            created["changeset"] = _halfwidth(changeset)
+        if timestamp is not None:
+            created["timestamp"] = _nfkc(timestamp)
+        if user is not None:
+            created["user"] = _nfkc(user)
+        if uid is not None:
+            created["uid"] = _halfwidth(uid)
+    if created:
+        node["created"] = created
+
+    # latitude and longitude are added to a "pos" array as float numbers
+    lat = get("lat")
+    lon = get("lon")
+    if lat and lon:
+        node["pos"] = [float(lat), float(lon)]
+
+    # other attributes (e.g. "visible") are turned into regular key/value pairs
+    known = (atr_id is not None) + len(created) + (lat is not None) + (lon is not None)
+    if len(attrib) > known:
+        for atr, value in attrib.items():
+            if atr not in KNOWN_ATTRIBUTES:
+                node[atr] = _nfkc(value)
+
+    # process second-level tags once, after all attributes
+    for tag in tags:
+        tk = tag.get("k")
+        tagv = tag.get("v")
+        # ignores tags without "k" or "v" value
+        if tk is None or tagv is None:
+            continue
+        ad = _addr_match(tk)
+        # ignores if "k" value contains problematic characters
+        if not PROBLEMCHARS.isdisjoint(tk):
+            pass
+        elif ad: # starts with "addr:"
+            # extracts the key under address
+            ad_cont = tk[5:]
+            # ignores if there is a second ":" 
+            if _lower_colon_search(ad_cont):
+                pass
+            # add to a dictionary "address"
+            else:
+                # full-width/encircled numbers are turned into half-width
+                node.setdefault("address", {})[ad_cont] = _nfkc(tagv)
+        else: # does not start with "addr:"
+            if tk == "type": # if "k" = "type", modify the key to "type_m"
+                node["type_m"] = _nfkc(tagv)
+            else:
+                node[tk] = _nfkc(tagv)
+
+                
+    ## clean address values
+    if "address" in node:
+        ## focus five address keys
+        address_key = ["city", "street", "housenumber", "housename", "postcode"]
+        
+        address = node["address"]
+        for key in address_key:
+            if key in address:
+                ## remove parenthesized characters, "yes", separeted characters by ";", and whitespaces in one pass
+                text = _addr_clean_sub("", address[key])
+                address[key] = text
+                ## key-specific cleaning
+                _CLEANERS[key](text, address, node)
+
+        """
+        for development use  
+        """
+        """
+        for key in address_key:
+            if key in node["address"]:
+                print key, node["address"][key]
+            else:
+                print key, " "
+        print ""
+        """
+        """
+        """
+
+    ## "ref"s are added to list "node_refs"
+    if kind == "way":
+        node_refs = [nd.get("ref") for nd in nds]
+        if node_refs:
+            node["node_refs"] = node_refs
+
+
+    return node
+
+
 def shape_element(element):
     # process only "node" and "way" top-level tags
     if element.tag == "node" or element.tag == "way" :
-        node = {}
-        lat = None
-        lon = None
-        node["type"] = element.tag
-
-        for atr in element.attrib:
-            # attributes in the CREATED array are added under a key "created"
-            if atr in CREATED:
-                if not node.has_key("created"):
-                    node["created"] = {}
-                # converts full-width characters and encircled numbers into half-width characters
-                node["created"][atr] = unicodedata.normalize('NFKC', unicode(element.get(atr)))
-
-            # latitude and longitude are added to a "pos" array as float numbers
-            elif atr == "lat" or atr == "lon":
-                if atr == "lat":
-                    lat = element.get(atr)
-                elif atr == "lon":
-                    lon = element.get(atr)
-                if lat and lon:
-                    node["pos"] = [float(lat), float(lon)]
-
-            # other tags are turned into regular key/value pairs        
-            else:
-                # converts full-width numbers and encircled numbers into half-width ones
-                node[atr] = unicodedata.normalize('NFKC', unicode(element.get(atr)))
-                        
-            # process second-level tags
-            for tag in element.iter("tag"):
-                tk = tag.get("k")
-                ad = addr.match(tk)
-                tagv = tag.get("v")
-                # ignores if "k" value contains problematic characters
-                if problemchars.search(tk):
-                    pass
-                elif ad: # starts with "addr:"
-                    # extracts the key under address
-                    ad_cont = tk[5:]
-                    # ignores if there is a second ":" 
-                    if lower_colon.search(ad_cont):
-                        pass
-                    # add to a dictionary "address"
-                    else:
-                        if not node.has_key("address"):
-                            node["address"] = {}
-                        # full-width/encircled numbers are turned into half-width
-                        node["address"][ad_cont] = unicodedata.normalize('NFKC', unicode(tagv))
-                else: # does not start with "addr:"
-                    if tk == "type": # if "k" = "type", modify the key to "type_m"
-                        node["type_m"] = unicodedata.normalize('NFKC', unicode(tagv))
-                    else:
-                        node[tk] = unicodedata.normalize('NFKC', unicode(tagv))
-
-                    
-        ## clean address values
-        if node.has_key("address"):
-            ## focus five address keys
-            address_key = ["city", "street", "housenumber", "housename", "postcode"]
-            
-            for key in address_key:
-                if node["address"].has_key(key):
-                    text = node["address"][key]
-                    problem_chars = addr_problemchars.search(text)
-                    semi_chars = addr_semicolon.search(text)
-                    space_chars = addr_space.search(text)
-                    
-                    ## remove parenthesized characters, "yes", separeted characters by ";", and whitespaces
-                    if problem_chars:
-                        pc = problem_chars.group()
-                        text = text.replace(pc, "")
-                        node["address"][key] = text
-                    if semi_chars:
-                        sc = semi_chars.group()
-                        text = text.replace(sc, "")
-                        node["address"][key] = text
-                    if space_chars:
-                        spc = space_chars.group()
-                        text = text.replace(spc, "")
-                        node["address"][key] = text
-                        
-
-                    ## "city" value only contains "city(***市)" 
-                    if key == "city":
-                        city_chars = re_city.search(text)
-                        ward_chars = re_ward.search(text)
-                        if city_chars:
-                            text = city_chars.group()
-                            node["address"][key] = text
-                        else:
-                            node["address"][key] = ""
-
-                        ## if "city" value contains "ward(***区)", that part is moved to "street" value 
-                        if ward_chars:
-                            text = ward_chars.group()
-                            if node["address"].has_key("street"):
-                                node["address"]["street"] = text + node["address"]["street"]
-                            else:
-                                node["address"]["street"] = text
-
-                    ## remove hyphen from "postcode"
-                    if key == "postcode":
-                        wrong_post = re_postcode.search(text)
-                        if wrong_post:
-                            node["address"][key] = text[0:3] + text[4:8]
-                                
-                    ## solve confused "housenumber"/"street" problem 
-                    if key == "housenumber" or key == "street":
-                        phonenum = re_phonenumber.search(text)
-                        postnum = re_postcode.search(text)
-                        ## phonenumber goes to "phone" value in "created" dictionary
-                        if phonenum:
-                            if not node["created"].has_key("phone"):
-                                node["created"]["phone"] = text
-                                node["address"][key] = ""
-                        ## postcode goes to "postcode" value in "address" dictionary
-                        elif postnum:
-                            if not node["address"].has_key("postcode"):
-                                node["address"]["postcode"] = text[0:3] + text[4:8]
-                                node["address"][key] = ""    
-                
-                else:
-                    pass
-
-            """
-            for development use  
-            """
-            """
-            for key in address_key:
-                if node["address"].has_key(key):
-                    print key, node["address"][key]
-                else:
-                    print key, " "
-            print ""
-            """
-            """
-            """
-
-        ## "ref"s are added to list "node_refs"
-        if element.tag == "way":
-            for tag in element.iter("nd"):
-                if not node.has_key("node_refs"):
-                    node["node_refs"] = []
-                node["node_refs"].append(tag.get("ref"))
-
-
-        return node
+        # "tag" and "nd" are always direct children
+        return _shape(element.tag, element.attrib, element.iterfind("tag"), element.iterfind("nd"))
     else:
         return None
 
 
-def process_map(file_in, pretty = False):
-    file_out = "{0}.json".format(file_in)
+# number of serialized records written to the file at once
+CHUNK_SIZE = 10000
+
+# encoders for the two output formats, built once.
+# json.dumps builds a new JSONEncoder on every call when options are given.
+# added "ensure_ascii=False"
+_json_encode = json.JSONEncoder(ensure_ascii=False).encode
+_json_encode_pretty = json.JSONEncoder(indent=2, ensure_ascii=False).encode
+
+# returns one shaped element as UTF-8 encoded JSON bytes
+def _dumps(el, pretty = False):
+    if orjson:
+        if pretty:
+            return orjson.dumps(el, option=orjson.OPT_INDENT_2)
+        return orjson.dumps(el)
+    if pretty:
+        return _json_encode_pretty(el).encode("utf-8")
+    return _json_encode(el).encode("utf-8")
+
+
+# shapes the "node" and "way" elements of an OSM file (a path or a file object)
+# and writes them into "fo" as JSON lines
+def _write_shaped(source, fo, pretty = False, collect = False):
+    # shaped elements are kept in memory only when "collect" is True
     data = []
-    with codecs.open(file_out, "w", 'utf-8') as fo:
-        for _, element in ET.iterparse(file_in):
-            el = shape_element(element)
-            if el:
+    # serialized records waiting to be written
+    chunk = []
+    # only top-level elements are surfaced by the parser.
+    # "relation" is not shaped (shape_element returns None), but it is surfaced so that it is released too
+    for _, element in ET.iterparse(source, events=("end",), tag=("node", "way", "relation")):
+        el = shape_element(element)
+        # release the parsed element and its preceding siblings to keep memory flat
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+        if el:
+            if collect:
                 data.append(el)
-                # added "ensure_ascii=False"
-                if pretty:
-                    fo.write(json.dumps(el, indent=2, ensure_ascii=False)+"\n")
-                else:
-                    fo.write(json.dumps(el, ensure_ascii=False) + "\n")
+            chunk.append(_dumps(el, pretty))
+            if len(chunk) >= CHUNK_SIZE:
+                fo.write(b"\n".join(chunk))
+                fo.write(b"\n")
+                del chunk[:]
+    if chunk:
+        fo.write(b"\n".join(chunk))
+        fo.write(b"\n")
     return data
 
+
+def process_map(file_in, pretty = False, collect = False):
+    file_out = "{0}.json".format(file_in)
+    # 1 MiB write buffer so that each line does not hit the disk separately
+    with open(file_out, "wb", 1 << 20) as fo:
+        return _write_shaped(file_in, fo, pretty, collect)
+
+
+## parsing without building elements
+
+# parser target which shapes "node" and "way" elements straight from the parser events,
+# so that no Element is allocated for them or their "tag"/"nd" children
+class OsmTarget(object):
+    def __init__(self, fo, pretty = False):
+        self.fo = fo
+        self.pretty = pretty
+        self._current_kind = None
+        self._current_attrib = None
+        self._current_tags = []
+        self._current_nds = []
+        # serialized records waiting to be written
+        self._chunk = []
+
+    def start(self, tag, attrib):
+        if tag == "node" or tag == "way":
+            self._current_kind = tag
+            self._current_attrib = attrib
+            self._current_tags = []
+            self._current_nds = []
+        elif self._current_kind is not None:
+            if tag == "tag":
+                self._current_tags.append(attrib)
+            elif tag == "nd":
+                self._current_nds.append(attrib)
+
+    def end(self, tag):
+        if tag == self._current_kind:
+            el = _shape(tag, self._current_attrib, self._current_tags, self._current_nds)
+            self._current_kind = None
+            self._chunk.append(_dumps(el, self.pretty))
+            if len(self._chunk) >= CHUNK_SIZE:
+                self._flush()
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        self._flush()
+
+    def _flush(self):
+        if self._chunk:
+            self.fo.write(b"\n".join(self._chunk))
+            self.fo.write(b"\n")
+            del self._chunk[:]
+
+
+# same output as process_map, using OsmTarget instead of iterparse
+def process_map_target(file_in, pretty = False):
+    file_out = "{0}.json".format(file_in)
+    with open(file_out, "wb", 1 << 20) as fo:
+        parser = ET.XMLParser(target=OsmTarget(fo, pretty), huge_tree=True, collect_ids=False)
+        with open(file_in, "rb") as fi:
+            while True:
+                buf = fi.read(1 << 20)
+                if not buf:
+                    break
+                parser.feed(buf)
+        parser.close()
+
+
+## parallel processing
+
+# reads the byte range [start, end) of an OSM file wrapped in <osm>...</osm>,
+# so that a shard can be parsed as a document of its own
+class _Shard(object):
+    def __init__(self, file_in, start, end):
+        self.f = open(file_in, "rb")
+        self.f.seek(start)
+        self.remaining = end - start
+        self.head = b"<osm>"
+        self.tail = b"</osm>"
+
+    def read(self, size = -1):
+        if size is None or size < 0:
+            size = 1 << 20
+        if self.head:
+            head, self.head = self.head, b""
+            return head
+        if self.remaining > 0:
+            buf = self.f.read(min(size, self.remaining))
+            self.remaining -= len(buf)
+            return buf
+        tail, self.tail = self.tail, b""
+        return tail
+
+    def close(self):
+        self.f.close()
+
+
+# returns the offsets of the lines which open a "node" or a "way" element,
+# and the offset of the closing </osm> line.
+# OSM XML has one top-level element per line.
+def _element_offsets(file_in):
+    starts = []
+    end = None
+    pos = 0
+    with open(file_in, "rb") as f:
+        for line in f:
+            stripped = line.lstrip()
+            if stripped.startswith(b"<node ") or stripped.startswith(b"<way "):
+                starts.append(pos)
+            elif stripped.startswith(b"</osm>"):
+                end = pos
+            pos += len(line)
+    return starts, end
+
+
+def _process_shard(args):
+    file_in, start, end, file_part, pretty = args
+    shard = _Shard(file_in, start, end)
+    try:
+        with open(file_part, "wb", 1 << 20) as fo:
+            _write_shaped(shard, fo, pretty)
+    finally:
+        shard.close()
+    return file_part
+
+
+# same output as process_map, but the file is split on "node"/"way" boundaries
+# and the shards are shaped in a pool of processes.
+# each shard is written to "<file_out>.partN" and the parts are concatenated in order.
+def process_map_parallel(file_in, pretty = False, processes = None):
+    file_out = "{0}.json".format(file_in)
+    starts, end = _element_offsets(file_in)
+    if not starts or end is None or end < starts[-1]:
+        # the file does not have one element per line (e.g. it is minified),
+        # so there are no safe places to split it
+        process_map(file_in, pretty)
+        return
+
+    processes = processes or multiprocessing.cpu_count()
+    # a few shards per process, so that a slow shard does not hold up the pool
+    n_shards = min(len(starts), processes * 4)
+    size = (end - starts[0]) // n_shards + 1
+    bounds = [starts[0]]
+    for offset in starts:
+        if offset - bounds[-1] >= size:
+            bounds.append(offset)
+    bounds.append(end)
+
+    tasks = [(file_in, bounds[i], bounds[i + 1], "{0}.part{1}".format(file_out, i), pretty)
+             for i in range(len(bounds) - 1)]
+    parts = [task[3] for task in tasks]
+    try:
+        ctx = multiprocessing.get_context("spawn")
+    except AttributeError: # Python 2
+        ctx = multiprocessing
+    try:
+        pool = ctx.Pool(processes)
+        try:
+            pool.map(_process_shard, tasks, 1)
+        finally:
+            pool.close()
+            pool.join()
+
+        with open(file_out, "wb") as fo:
+            for file_part in parts:
+                with open(file_part, "rb") as fp:
+                    shutil.copyfileobj(fp, fo, 1 << 20)
+    finally:
+        # the parts are removed even when a worker fails
+        for file_part in parts:
+            if os.path.exists(file_part):
+                os.remove(file_part)
+
 def test():
     # NOTE: if you are running this code on your computer, with a larger dataset, 
     # call the process_map procedure with pretty=False. The pretty=True option adds 
     # additional spaces to the output, making it significantly larger.
-    data = process_map('kyoto_japan.osm', False)
+    test_clean_city()
+    process_map('kyoto_japan.osm', False, collect=False)
 
 if __name__ == "__main__":
     test()